@@ -0,0 +1,6 @@
+# Freeze relay modules into MicroPython firmware:
+#   make -C ports/esp32 BOARD=ESP32_GENERIC FROZEN_MANIFEST=/path/to/esp32_time_relay/manifest.py
+include("$(PORT_DIR)/boards/manifest.py")
+
+freeze("src", "time_relay.py", opt=3)
+freeze("libs", ("lcd_api.py", "machine_i2c_lcd.py"), opt=3)
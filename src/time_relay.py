@@ -1,8 +1,10 @@
-import encoderLib
-import time, os
+import time, os, gc
+import asyncio
+import esp32
+import micropython
 from micropython import const
-from machine import I2C, Pin, Timer, RTC as _RTC, reset
-from machine_i2c_lcd import I2cLcd
+from machine import I2C, Pin, Timer, reset, lightsleep, wake_reason, EXT0_WAKE, EXT1_WAKE
+from machine_i2c_lcd import I2cLcd, MASK_RS, MASK_E, SHIFT_BACKLIGHT, SHIFT_DATA
 import json
 
 # constants
@@ -12,16 +14,61 @@ LINE_PIN = const(26)
 DISPLAY_SCL_PIN = const(22)
 DISPLAY_SDA_PIN = const(21)
 RELAY_PIN = const(10)
+BTN_PIN = const(27)
+ENC_A_PIN = const(14)
+ENC_B_PIN = const(13)
+IDLE_TIMEOUT = const(30)  # seconds
+BTN_DEBOUNCE_MS = const(25)  # button changes closer to the last accepted one are contact bounce
+IDLE_SLEEP_MS = const(1000)  # max light sleep period while idle
+GC_LOOPS_MASK = const(0x3f)  # collect garbage every 64 main loop iterations
 ON = const(1)
 OFF = const(0)
-# Init real time clock
-RTC = _RTC()
-RTC.datetime((2020, 1, 1, 0, 0, 0, 0, 0))
+EVENTS_POOL_SIZE = const(32)  # power of 2
+_EVENTS_MASK = const(EVENTS_POOL_SIZE - 1)
+# event codes
+EV_HIDE_MESSAGE = const(1)
+EV_IDLE_ON = const(2)
+EV_IDLE_OFF = const(3)
+EV_KEY = const(4)
+EV_SET_STATE = const(5)
+EV_UPDATE_ETA = const(6)
+EV_ONLINE_CHANGED = const(7)
+EV_OFFLINE_CHANGED = const(8)
+EV_STOP = const(9)
+EV_START_ON = const(10)
+EV_START_OFF = const(11)
+EV_RESTART = const(12)
+EV_RESET = const(13)
+EV_REBOOT = const(14)
+EV_HARD_RESET = const(15)
+EV_NEXT = const(16)
+_EV_COUNT = const(17)
+# encoder transitions, index is (prev_ab << 2) | ab: 0 - none or bounce, 1 - up, 2 - down
+_ENC_MASK = const(0xffff)  # encoder counter wraps, keeps it a small int
+_ENC_LUT = bytes((0, 2, 1, 0, 1, 0, 0, 2, 2, 0, 0, 1, 0, 1, 2, 0))
+# '00'..'99' for time formatting without str.format
+_DIGIT_PAIRS = tuple('{:02d}'.format(i) for i in range(100))
+# traceback of errors raised in hard interrupts
+micropython.alloc_emergency_exception_buf(100)
+
+
+@micropython.viper
+def _enc_step(prev: int, ab: int) -> int:
+    lut = ptr8(_ENC_LUT)
+    return lut[(prev << 2) | ab]
+
+
+# wakes the main loop, set by anything emitting events outside of it (interrupts, timers)
+WAKE = asyncio.ThreadSafeFlag()
 
 
 class Store:
     """Class for storing/reading config on the flash"""
+    # keys: online_changed, offline_changed - timers in minutes, i2c_freq - probed LCD bus frequency
     file_path = 'options.json'
+    # RAM copy of the file, changes are written only by flush()
+    _cache = None
+    _dirty = False
 
     @classmethod
     def get(cls, key, default=None):
@@ -30,18 +77,27 @@ class Store:
     @classmethod
     def set(cls, key, value):
         data = cls._read()
-        data[key] = value
-        cls._write(data)
+        if data.get(key) != value:
+            data[key] = value
+            cls._dirty = True
 
     @classmethod
     def rem(cls, key):
         data = cls._read()
         if key in data:
             del data[key]
-        cls._write(data)
+            cls._dirty = True
+
+    @classmethod
+    def flush(cls):
+        """Write changed options to the flash"""
+        if cls._dirty and cls._write(cls._cache):
+            cls._dirty = False
 
     @classmethod
     def clear(cls):
+        cls._cache = {}
+        cls._dirty = False
         try:
             os.remove(cls.file_path)
         except OSError:
@@ -49,6 +105,12 @@ class Store:
 
     @classmethod
     def _read(cls):
+        if cls._cache is None:
+            cls._cache = cls._load()
+        return cls._cache
+
+    @classmethod
+    def _load(cls):
         try:
             f = open(cls.file_path)
         except OSError:
@@ -73,36 +135,85 @@ class Store:
 
 class RObject:
     """Base object for event system"""
-    _objects = []
+    # tuples of bound handler methods indexed by event code
+    _subs = [()] * _EV_COUNT
+    # event code -> handler method name, declared by subclasses
+    _HANDLERS = {}
+    # ring of event, argc, args slots shared by all objects, stored flat in one list
+    _pool = [None, 0, None] * EVENTS_POOL_SIZE
+    _head = 0
+    _tail = 0
 
     def __init__(self):
-        self.__events = []
-        self.__class__._objects.append(self)
-
-    @property
-    def events(self):
-        return self.__events
-
-    def emit(self, event, *args):
-        self.__events.append([event, args])
-
-    def receive(self, event, *args):
-        pass
-
-    @classmethod
-    def get_objects(cls):
-        return cls._objects
+        subs = RObject._subs
+        for event, name in self._HANDLERS.items():
+            # tuples are built once here and iterated on every dispatch
+            subs[event] += (getattr(self, name),)
+
+    @staticmethod
+    def _slot():
+        """Pool index of a free slot, -1 if the ring is full"""
+        i = RObject._tail
+        nxt = (i + 1) & _EVENTS_MASK
+        if nxt == RObject._head:
+            # drop the event, the controller must keep running
+            return -1
+        # not atomic, so interrupts and timer callbacks never emit, they set flags for the main loop
+        RObject._tail = nxt
+        return i * 3
+
+    def emit(self, event, args=()):
+        """Emit event with a tuple of arguments, a prebuilt tuple is stored as is"""
+        i = self._slot()
+        if i < 0:
+            return
+        pool = RObject._pool
+        pool[i] = event
+        pool[i + 1] = 2
+        pool[i + 2] = args
+
+    def emit0(self, event):
+        """Emit event without arguments"""
+        i = self._slot()
+        if i < 0:
+            return
+        pool = RObject._pool
+        pool[i] = event
+        pool[i + 1] = 0
+
+    def emit1(self, event, arg):
+        """Emit event with single argument, no args tuple is created"""
+        i = self._slot()
+        if i < 0:
+            return
+        pool = RObject._pool
+        pool[i] = event
+        pool[i + 1] = 1
+        pool[i + 2] = arg
 
     @classmethod
     def process_events(cls):
-        objects = cls.get_objects()
-        for item in objects:
-            e = item.events
-            if e:
-                while e:
-                    ev = e.pop()
-                    for c in objects:
-                        c.receive(ev[0], *ev[1])
+        subs = RObject._subs
+        pool = RObject._pool
+        head = RObject._head
+        while head != RObject._tail:
+            i = head * 3
+            event = pool[i]
+            argc = pool[i + 1]
+            args = pool[i + 2]
+            pool[i] = pool[i + 2] = None
+            # release the slot before dispatch, handlers emit new events
+            head = RObject._head = (head + 1) & _EVENTS_MASK
+            handlers = subs[event]
+            if argc == 0:
+                for handler in handlers:
+                    handler()
+            elif argc == 1:
+                for handler in handlers:
+                    handler(args)
+            else:
+                for handler in handlers:
+                    handler(*args)
 
 
 class Display(RObject):
@@ -110,52 +221,191 @@ class Display(RObject):
     DEFAULT_I2C_ADDR = 0x27
     ROWS = 4
     LINES = 20
+    I2C_MAX_FREQ = 1000000
+    I2C_MIN_FREQ = 100000
+    # LCD needs at least 37 us to execute a write, use some margin
+    LCD_WRITE_US = 40
 
-    def __init__(self):
+    def __init__(self, i2c, freq=None):
+        """i2c bus may be shared with other devices, unknown freq is taken as max for safe LCD timing"""
         super(Display, self).__init__()
-        i2c = I2C(0, scl=Pin(DISPLAY_SCL_PIN), sda=Pin(DISPLAY_SDA_PIN), freq=400000)
+        if freq is None:
+            freq = self.I2C_MAX_FREQ
         self.lcd = I2cLcd(i2c, self.DEFAULT_I2C_ADDR, 4, 20)
+        # bus bytes per LCD write in bulk transfers, 9 bits per byte on the wire
+        self._step = max(4, -(-freq * self.LCD_WRITE_US // 9000000))
         self.render_enabled = True
+        # message timer is created by first message and re-armed by next ones
         self.timer = None
+        self._timeout_callback = self.on_message_timeout
+        self._timed_out = False
+        # screen bytes: _back is drawn by flush(), _front is what the LCD shows now
+        size = self.LINES * self.ROWS
+        self._back = bytearray(b' ' * size)
+        self._front = bytearray(b' ' * size)
+        self._message = bytearray(size)
+        # bitmask of rows changed in _back since last flush
+        self._dirty = 0
+        # reusable transfer buffer for the whole screen
+        self._screen_buf = memoryview(bytearray(self._step * (self.LINES + 1) * self.ROWS))
+
+    @classmethod
+    def init_i2c(cls):
+        """Bus and its frequency, the highest one the LCD backpack answers to, stored after first probe"""
+        freq = Store.get('i2c_freq')
+        if freq:
+            return I2C(0, scl=Pin(DISPLAY_SCL_PIN), sda=Pin(DISPLAY_SDA_PIN), freq=freq), freq
+        freq = cls.I2C_MAX_FREQ
+        while True:
+            i2c = I2C(0, scl=Pin(DISPLAY_SCL_PIN), sda=Pin(DISPLAY_SDA_PIN), freq=freq)
+            try:
+                i2c.writeto(cls.DEFAULT_I2C_ADDR, b'\x00')
+                i2c.readfrom(cls.DEFAULT_I2C_ADDR, 1)
+                break
+            except OSError:
+                # NAK or bus error
+                if freq <= cls.I2C_MIN_FREQ:
+                    raise
+                freq //= 2
+        Store.set('i2c_freq', freq)
+        Store.flush()
+        return i2c, freq
 
     def display(self, text):
-        if not self.render_enabled:
-            return
-        lines = text.split('\n')  # type: list
-        if len(lines) < 4:
-            lines += [''] * (4 - len(lines))
-        lines = ['{:<20}'.format(l[:20]) for l in lines]
-        self.lcd.putstr('\n'.join([x for x in lines]))
+        self._fill(self._back, text.encode())
+        self._dirty = 0b1111
+        self.flush()
 
     def print_line(self, line, text, start_pos=0):
-        if not self.render_enabled:
-            return
-        self.lcd.move_to(start_pos, line)
-        self.lcd.putstr(text)
+        """Put text to the screen buffer, it is drawn by next flush()"""
+        back = self._back
+        self._dirty |= 1 << line
+        i = line * self.LINES + start_pos
+        if isinstance(text, str):
+            for char in text:
+                back[i] = ord(char)
+                i += 1
+        else:
+            back[i:i + len(text)] = text
+
+    def clear_column(self, col):
+        """Put spaces to one column of all rows"""
+        back = self._back
+        for i in range(col, len(back), self.LINES):
+            back[i] = 0x20
+        self._dirty = 0b1111
+
+    def flush(self):
+        """Write changed parts of the screen, while a message is shown changes are kept for later"""
+        if self.render_enabled and self._dirty:
+            self._write(self._back, self._dirty)
+            self._dirty = 0
+
+    def _write(self, src, rows=0b1111):
+        # changed span of every row in rows mask in a single I2C transaction
+        buf = self._screen_buf
+        front = self._front
+        width = self.LINES
+        cmd_flags = self.lcd.backlight << SHIFT_BACKLIGHT
+        flags = MASK_RS | cmd_flags
+        i = 0
+        for line in range(self.ROWS):
+            if not rows & (1 << line):
+                continue
+            start = line * width
+            end = start + width
+            while start < end and src[start] == front[start]:
+                start += 1
+            if start == end:
+                continue
+            while src[end - 1] == front[end - 1]:
+                end -= 1
+            i = self._pack(buf, i, self._cursor_cmd(line, start - line * width), cmd_flags)
+            for k in range(start, end):
+                c = src[k]
+                front[k] = c
+                i = self._pack(buf, i, c, flags)
+        if i:
+            self.lcd.i2c.writeto(self.lcd.i2c_addr, buf[:i])
+
+    def _fill(self, dst, data, center=False):
+        """Copy newline separated rows of bytes to a screen buffer.
+        Rows are cut and padded to full width, centered rows are stripped too."""
+        width = self.LINES
+        size = len(data)
+        start = 0
+        for line in range(self.ROWS):
+            end = data.find(b'\n', start)
+            if end < 0:
+                end = size
+            next_start = end + 1
+            offset = 0
+            if center:
+                while start < end and data[start] == 0x20:
+                    start += 1
+                while end > start and data[end - 1] == 0x20:
+                    end -= 1
+            if end - start > width:
+                end = start + width
+            if center:
+                offset = (width - (end - start)) // 2
+            o = line * width
+            for k in range(start - offset, start - offset + width):
+                dst[o] = data[k] if start <= k < end else 0x20
+                o += 1
+            start = next_start
+
+    def _cursor_cmd(self, line, pos):
+        if line & 1:
+            pos += 0x40
+        if line & 2:
+            pos += self.LINES
+        return self.lcd.LCD_DDRAM | pos
+
+    def _pack(self, buf, i, value, flags):
+        # byte as two nibbles, each latched on falling edge of E, returns next buffer index
+        high = flags | (((value >> 4) & 0x0f) << SHIFT_DATA)
+        low = flags | ((value & 0x0f) << SHIFT_DATA)
+        buf[i] = high | MASK_E
+        buf[i + 1] = high
+        buf[i + 2] = low | MASK_E
+        buf[i + 3] = low
+        end = i + self._step
+        # hold bus until LCD executes the write
+        for j in range(i + 4, end):
+            buf[j] = low
+        return end
 
     def show_message(self, text, title='ERROR', timeout=3):
-        lines = text.split('\n')
-        lines = [x.strip()[:20].center(20) for x in lines]
-        title = title[:20].center(20)
-        self.lcd.clear()
-        self.lcd.move_to(0, 0)
-        self.lcd.putstr(title)
-        for i, line in enumerate(lines[:3], 1):
-            self.lcd.move_to(0, i)
-            self.lcd.putstr(line)
+        self._fill(self._message, (title + '\n' + text).encode(), center=True)
+        self._write(self._message)
         if timeout:
+            # screen buffer keeps the covered screen
             self.render_enabled = False
-            self.timer = Timer(2)
-            self.timer.init(period=timeout*1000, mode=Timer.ONE_SHOT, callback=self.hide_message)
+            if self.timer is None:
+                self.timer = Timer(2)
+            self.timer.init(period=timeout*1000, mode=Timer.ONE_SHOT, callback=self._timeout_callback)
 
-    def hide_message(self, *args):
-        self.timer = None
+    def on_message_timeout(self, *args):
+        # timer callback, the message is hidden by update() in the main loop
+        self._timed_out = True
+        WAKE.set()
+
+    def update(self):
+        """Emit events of timeouts passed since last call"""
+        if self._timed_out:
+            self._timed_out = False
+            self.emit0(EV_HIDE_MESSAGE)
+
+    def hide_message(self):
+        # covered screen is restored by next flush()
         self.render_enabled = True
-        self.lcd.clear()
-        self.emit('rerender')
+        self._dirty = 0b1111
 
     def clear(self):
         self.lcd.clear()
+        for i in range(len(self._back)):
+            self._back[i] = self._front[i] = 0x20
 
     def off(self):
         self.lcd.backlight_off()
@@ -163,116 +413,211 @@ class Display(RObject):
     def on(self):
         self.lcd.backlight_on()
 
-    def receive(self, event, *args):
-        if event == 'idle_off':
-            self.on()
-        elif event == 'idle_on':
-            self.off()
+    _HANDLERS = {
+        EV_IDLE_OFF: 'on',
+        EV_IDLE_ON: 'off',
+        EV_HIDE_MESSAGE: 'hide_message',
+    }
 
 
-LCD = Display()
+# created by setup() on the shared I2C bus
+LCD = None  # type: Display
 
 
 class IdleTimer(RObject):
     """IDLE timer to switch ON/OFF of display"""
-    IDLE_TIMEOUT = const(30)
-    TIMEOUT_CHECK = const(10)
 
     def __init__(self):
         super(IdleTimer, self).__init__()
         self.idle_timer = Timer(5)
         self.is_idle = False
-        self.last_active = time.time()
+        # bound once, re-armed on every key event
+        self._timeout_callback = self.on_idle_timeout
+        self._timed_out = False
         self.start_idle_timer()
 
     def start_idle_timer(self):
-        self.idle_timer.init(period=self.TIMEOUT_CHECK * 1000, mode=Timer.PERIODIC, callback=self.on_idle_timeout)
+        self.arm_timer()
         self.is_idle = False
-        self.emit('idle_off')
+        self.emit0(EV_IDLE_OFF)
+
+    def arm_timer(self):
+        # one shot timer restarted by activity is the timeout itself
+        self.idle_timer.init(period=IDLE_TIMEOUT * 1000, mode=Timer.ONE_SHOT, callback=self._timeout_callback)
 
     def on_idle_timeout(self, *args):
-        if self.is_idle:
-            return
-        current = time.time()
-        expire_time = current - self.last_active
-        if expire_time > self.IDLE_TIMEOUT:
+        # timer callback, idle mode is entered by update() in the main loop
+        self._timed_out = True
+        WAKE.set()
+
+    def update(self):
+        """Emit events of timeouts passed since last call"""
+        if self._timed_out:
+            self._timed_out = False
             self.idle_on()
 
     def idle_on(self):
-        self.emit('idle_on')
+        self.emit0(EV_IDLE_ON)
         self.is_idle = True
 
     def idle_off(self):
-        self.emit('idle_off')
+        self.emit0(EV_IDLE_OFF)
         self.is_idle = False
 
-    def receive(self, event, *args):
-        if event == 'on_key_event':
-            # mve or click encoder to exit idle mode
-            self.last_active = time.time()
-            if self.is_idle:
-                self.idle_off()
-        if event == 'stop':
-            self.idle_timer.deinit()
+    def _on_key_event(self):
+        # move or click encoder to exit idle mode
+        self.arm_timer()
+        if self.is_idle:
+            self.idle_off()
+
+    def _on_stop(self):
+        self.idle_timer.deinit()
+
+    _HANDLERS = {
+        EV_KEY: '_on_key_event',
+        EV_STOP: '_on_stop',
+    }
 
 
 class Events(RObject):
     """Events listener and executor"""
-    BTN_PIN = const(27)
-    ENC_PIN = [14, 13]
 
     def __init__(self, on_left, on_right, on_press):
         super(Events, self).__init__()
         # parts
-        self._btn = Pin(self.BTN_PIN, Pin.IN, Pin.PULL_UP)
-        self._enc = encoderLib.encoder(self.ENC_PIN[0], self.ENC_PIN[1])
+        self._btn = Pin(BTN_PIN, Pin.IN, Pin.PULL_UP)
+        self._enc_clk = Pin(ENC_A_PIN, Pin.IN, Pin.PULL_UP)
+        self._enc_dt = Pin(ENC_B_PIN, Pin.IN, Pin.PULL_UP)
+        # bound once for interrupt handlers and update()
+        self._btn_value = self._btn.value
+        self._clk_value = self._enc_clk.value
+        self._dt_value = self._enc_dt.value
         # values
         self.last_enc_value = 0
         self.last_btn_value = 1
+        self.last_btn_time = 0
         self._is_idle_mode = False
+        # changed by interrupts, consumed by update()
+        self._enc_value = 0
+        self._enc_ab = (self._clk_value() << 1) | self._dt_value()
+        self._enc_steps = 0
+        self._btn_changed = False
         # callbacks
         self.ol_clb = on_left
         self.or_clb = on_right
         self.op_clb = on_press
+        self._init_irq()
+        self._init_wake()
+
+    def _init_irq(self):
+        # encoder edges are handled in hard irq so fast turns can't overflow the schedule queue
+        self._btn.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=self._btn_isr)
+        self._enc_clk.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=self._enc_isr, hard=True)
+        self._enc_dt.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=self._enc_isr, hard=True)
+
+    def _init_wake(self):
+        # ext0 holds one pin only: button press on ext0,
+        # encoder turn passes through both pins low between detents, ext1
+        esp32.wake_on_ext0(pin=self._btn, level=esp32.WAKEUP_ALL_LOW)
+        esp32.wake_on_ext1(pins=(self._enc_clk, self._enc_dt), level=esp32.WAKEUP_ALL_LOW)
+
+    def sleep(self, ms):
+        """Light sleep until timeout, button press or encoder turn, input only wakes up"""
+        lightsleep(ms)
+        # elapsed time is unreliable, a timer wake may come early to cover the wake up time
+        reason = wake_reason()
+        woken = reason == EXT0_WAKE or reason == EXT1_WAKE
+        # edges were not tracked while sleeping
+        self._enc_ab = (self._clk_value() << 1) | self._dt_value()
+        self._enc_steps = 0
+        self.last_btn_value = self._btn_value()
+        if woken:
+            self.on_any_event()
+
+    def _enc_isr(self, pin):
+        # interrupt context: only update counters, no allocations
+        ab = (self._clk_value() << 1) | self._dt_value()
+        step = _enc_step(self._enc_ab, ab)
+        self._enc_ab = ab
+        if step == 1:
+            self._enc_steps += 1
+        elif step == 2:
+            self._enc_steps -= 1
+        if ab == 3:
+            # detent position, bounce steps are already cancelled out
+            if self._enc_steps > 1:
+                self._enc_value = (self._enc_value + 1) & _ENC_MASK
+                WAKE.set()
+            elif self._enc_steps < -1:
+                self._enc_value = (self._enc_value - 1) & _ENC_MASK
+                WAKE.set()
+            self._enc_steps = 0
+
+    def _btn_isr(self, pin):
+        self._btn_changed = True
+        WAKE.set()
 
     def on_left(self):
         if not self._is_idle_mode:
             self.ol_clb()
-        self.on_any_event()
 
     def on_right(self):
         if not self._is_idle_mode:
             self.or_clb()
-        self.on_any_event()
 
     def on_press(self):
         if not self._is_idle_mode:
             self.op_clb()
-        self.on_any_event()
 
     def on_any_event(self):
-        self.emit('on_key_event')
+        self.emit0(EV_KEY)
         self._is_idle_mode = False
 
+    @micropython.native
     def update(self):
+        """Dispatch input collected by interrupts since last call"""
+        # any input is reported once per update, however many steps passed
+        key = False
         # encoder
-        value = self._enc.getValue()
-        if value != self.last_enc_value:
-            if value > self.last_enc_value:
+        last_enc = self.last_enc_value
+        delta = (self._enc_value - last_enc) & _ENC_MASK
+        if delta:
+            key = True
+            self.last_enc_value = (last_enc + delta) & _ENC_MASK
+            # upper half of the range is a negative delta
+            steps = delta - (_ENC_MASK + 1) if delta > (_ENC_MASK >> 1) else delta
+            if self._is_idle_mode:
+                # first input only wakes up
+                steps = 1 if steps > 0 else -1
+            # several detents may pass between two updates
+            while steps > 0:
                 self.on_left()
-            else:
+                steps -= 1
+            while steps < 0:
                 self.on_right()
-            self.last_enc_value = value
+                steps += 1
         # button
-        btn_value = int(self._btn.value())
-        if self.last_btn_value != btn_value:
-            if btn_value == 0:
-                self.on_press()
-            self.last_btn_value = btn_value
-
-    def receive(self, event, *args):
-        if event == 'idle_on':
-            self._is_idle_mode = True
+        if self._btn_changed:
+            self._btn_changed = False
+            btn_value = self._btn_value()
+            if self.last_btn_value != btn_value:
+                now = time.ticks_ms()
+                # closer changes are contact bounce
+                if time.ticks_diff(now, self.last_btn_time) >= BTN_DEBOUNCE_MS:
+                    self.last_btn_time = now
+                    self.last_btn_value = btn_value
+                    if btn_value == 0:
+                        key = True
+                        self.on_press()
+        if key:
+            self.on_any_event()
+
+    def _on_idle_on(self):
+        self._is_idle_mode = True
+
+    _HANDLERS = {
+        EV_IDLE_ON: '_on_idle_on',
+    }
 
 
 class Program(RObject):
@@ -288,19 +633,27 @@ class Program(RObject):
         self.led_on = Pin(LED_ON_PIN, Pin.OUT)
         self.led_off = Pin(LED_OFF_PIN, Pin.OUT)
         self.power = Pin(LINE_PIN, Pin.OUT)
+        # bound once, used on every phase switch
+        self._led_on_value = self.led_on.value
+        self._led_off_value = self.led_off.value
+        self._power_value = self.power.value
         # values
         self.led_on.value(0)
         self.led_off.value(0)
+        # program task, paused while running is False, woken by _kick
         self.timer = None
+        self.running = False
+        self._kick = asyncio.Event()
         self.on_time = 0
         self.off_time = 0
         self.eta = 0
-        self.last_checked_time = 0
+        self.phase_start = 0
+        # eta is shown every second only while the display is on
+        self.display_on = True
         # init
         self.set_state(self.STATE_STOPPED)
 
     def start_timer(self):
-        # https://micronote.tech/2020/02/Timers-and-Interrupts-with-a-NodeMCU-and-MicroPython/
         if self.on_time == 0:
             LCD.show_message('ON time is ZERO')
             return
@@ -309,40 +662,69 @@ class Program(RObject):
             return
         if self.state != self.STATE_STOPPED:
             return
-        if self.timer:
-            self.stop_timer()
-        self.timer = Timer(-2)
-        self.timer.init(period=1000, mode=Timer.PERIODIC, callback=self.update_handler)
-        self.rest_rtc()
+        if self.timer is None:
+            # task lives till the end, stopped program only pauses it
+            self.timer = asyncio.create_task(self._run_timer())
+        self.running = True
+        self.reset_phase()
         return True
 
+    async def _run_timer(self, _time=time):
+        kick = self._kick
+        while True:
+            if not self.running:
+                kick.clear()
+                await kick.wait()
+                continue
+            if self.display_on:
+                # wake on whole seconds of the phase, no drift
+                await asyncio.sleep_ms(1000 - _time.ticks_diff(_time.ticks_ms(), self.phase_start) % 1000)
+            else:
+                # nobody sees the eta, wake only to switch the phase or when kicked
+                kick.clear()
+                try:
+                    await asyncio.wait_for_ms(kick.wait(), self.time_to_switch())
+                except asyncio.TimeoutError:
+                    pass
+            if self.running:
+                self.update_handler()
+                WAKE.set()
+
     def stop_timer(self, set_state=False):
         if self.state == self.STATE_STOPPED:
             return
-        if self.timer:
-            self.timer.deinit()
-            self.timer = None
+        self.running = False
         if set_state:
             self.set_state(self.STATE_STOPPED)
         return True
 
     def set_state(self, state):
         self.state = state
-        self.emit('set_state', self.state)
+        self.emit1(EV_SET_STATE, self.state)
 
-    def rest_rtc(self):
-        self.last_checked_time = time.time()
-        self.eta = 0
+    def time_to_switch(self, _time=time):
+        """Milliseconds left in the current phase, -1 if stopped"""
+        if self.state == self.STATE_STOPPED:
+            return -1
+        phase = self.on_time if self.state == self.STATE_ONLINE else self.off_time
+        return max(0, phase * 1000 - _time.ticks_diff(_time.ticks_ms(), self.phase_start))
 
-    def update_handler(self, *args, force_switch=False):
-        # get current time offset
-        offs = time.time() - self.last_checked_time
-        if self.state == self.STATE_ONLINE:
+    def reset_phase(self):
+        self.phase_start = time.ticks_ms()
+        self.eta = 0
+        # timer task may sleep till the end of previous phase
+        self._kick.set()
+
+    def update_handler(self, force_switch=False, _time=time):
+        # get current time offset in seconds
+        offs = _time.ticks_diff(_time.ticks_ms(), self.phase_start) // 1000
+        state = self.state
+        if state == self.STATE_ONLINE:
             # compute eta
             self.eta = self.on_time - offs
             if offs >= self.on_time or force_switch:
                 self.on_state_triggered(self.STATE_OFFLINE)
-        elif self.state == self.STATE_OFFLINE:
+        elif state == self.STATE_OFFLINE:
             # compute eta
             self.eta = self.off_time - offs
             if offs >= self.off_time or force_switch:
@@ -351,49 +733,67 @@ class Program(RObject):
 
     def update_display(self):
         # rerender tittle signal
-        self.emit('update_eta', self.eta)
-
-    def receive(self, event, *args):
-        if event == 'online_changed':
-            self.on_time = args[0]
-        elif event == 'offline_changed':
-            self.off_time = args[0]
-        elif event == 'stop':
-            self.stop()
-        elif event == 'start_on':
-            if self.start_timer():
-                self.set_state(self.STATE_ONLINE)
-                self.set_power(ON)
-        elif event == 'start_off':
-            if self.start_timer():
-                self.set_state(self.STATE_OFFLINE)
-                self.set_power(OFF)
-        elif event == 'restart':
-            self.emit('stop')
-            self.emit('start')
-        elif event == 'reset':
-            Store.clear()
-            self.stop()
-        elif event == 'reboot':
-            self.stop()
-            RObject.process_events()
-            reset()
-        elif event == 'next':
-            self.update_handler(force_switch=True)
+        self.emit1(EV_UPDATE_ETA, self.eta)
+
+    def _on_online_changed(self, value):
+        self.on_time = value
+
+    def _on_offline_changed(self, value):
+        self.off_time = value
+
+    def _on_start_on(self):
+        if self.start_timer():
+            self.set_state(self.STATE_ONLINE)
+            self.set_power(ON)
+
+    def _on_start_off(self):
+        if self.start_timer():
+            self.set_state(self.STATE_OFFLINE)
+            self.set_power(OFF)
+
+    def _on_restart(self):
+        # restart current phase, timer task keeps running
+        if self.state != self.STATE_STOPPED:
+            self.reset_phase()
+            self.update_display()
+
+    def _on_reset(self):
+        Store.clear()
+        self.stop()
+
+    def _on_reboot(self):
+        self.stop()
+        # queued after events emitted by stop(), so the display is updated first
+        self.emit0(EV_HARD_RESET)
+
+    def _on_hard_reset(self):
+        LCD.flush()
+        reset()
+
+    def _on_idle_on(self):
+        self.display_on = False
+
+    def _on_idle_off(self):
+        self.display_on = True
+        # timer task may sleep till the end of the phase
+        self._kick.set()
+
+    def _on_next(self):
+        self.update_handler(force_switch=True)
 
     def on_state_triggered(self, state=0):
-        self.rest_rtc()
+        self.reset_phase()
         self.set_state(state)
         self.set_power(max(0, state - 1))
 
     def set_power(self, value=False, led_off_value=None):
-        v = int(bool(value))
-        self.led_on.value(v)
+        v = 1 if value else 0
+        self._led_on_value(v)
         if led_off_value is not None:
-            self.led_off.value(led_off_value)
+            self._led_off_value(led_off_value)
         else:
-            self.led_off.value(int(not v))
-        self.power.value(v)
+            self._led_off_value(1 - v)
+        self._power_value(v)
 
     def stop(self):
         self.stop_timer()
@@ -401,12 +801,29 @@ class Program(RObject):
         self.set_power(OFF, OFF)
         self.eta = 0
 
+    _HANDLERS = {
+        EV_ONLINE_CHANGED: '_on_online_changed',
+        EV_OFFLINE_CHANGED: '_on_offline_changed',
+        EV_STOP: 'stop',
+        EV_START_ON: '_on_start_on',
+        EV_START_OFF: '_on_start_off',
+        EV_RESTART: '_on_restart',
+        EV_RESET: '_on_reset',
+        EV_REBOOT: '_on_reboot',
+        EV_HARD_RESET: '_on_hard_reset',
+        EV_NEXT: '_on_next',
+        EV_IDLE_ON: '_on_idle_on',
+        EV_IDLE_OFF: '_on_idle_off',
+    }
+
 
 class Controller(RObject):
     """Base controller class (GUI line)"""
     title = 'No Title'
     selectable = True
     max_width = 18
+    # fixed width of right aligned value, 0 - value is redrawn with the whole line
+    value_width = 0
 
     def __repr__(self):
         return '<Ctrl {}>'.format(self.title)
@@ -414,6 +831,10 @@ class Controller(RObject):
     def __init__(self):
         super(Controller, self).__init__()
         self.line = None
+        # bound once, so controllers can be created only after setup()
+        self._print_line = LCD.print_line
+        # title padded to max_width, reset to None when get_title() changes
+        self._padded_title = None
 
     def set_line(self, line):
         self.line = line
@@ -423,28 +844,41 @@ class Controller(RObject):
         return self.title
 
     def get_value(self):
-        """Right Text"""
+        """Right Text, str or bytes"""
         return '---'
 
     def on_enter(self):
         pass
 
     def on_left(self):
-        self.render()
+        self.render_value()
 
     def on_right(self):
-        self.render()
+        self.render_value()
 
     def on_exit(self):
-        self.render()
+        self.render_value()
 
-    def render(self):
+    def render_value(self):
+        """Redraw only the value part of the line"""
+        if not self.value_width:
+            return self.render()
         if self.line is not None:
-            text = '{:<{}}'.format(self.get_title(), self.max_width)
+            text = self.get_value()
+            if len(text) < self.value_width:
+                # time values are always full width, only labels are padded
+                text = '%*s' % (self.value_width, text)
+            self._print_line(self.line, text, start_pos=1 + self.max_width - self.value_width)
+
+    def render(self, _len=len):
+        if self.line is not None:
+            if self._padded_title is None:
+                self._padded_title = '%-*s' % (self.max_width, self.get_title()[:self.max_width])
+            # value is put over the title end, only changed cells are sent to LCD
+            self._print_line(self.line, self._padded_title, start_pos=1)
             value = self.get_value()
             if value:
-                text = text[:-len(value)] + value
-            LCD.print_line(self.line, text, start_pos=1)
+                self._print_line(self.line, value, start_pos=1 + self.max_width - _len(value))
 
 
 class Menu(RObject):
@@ -462,29 +896,36 @@ class Menu(RObject):
         self.max_index = len(self.items) - 1
         self.current_index = self.items.index([x for x in self.items if x.selectable][0])
         self.mode = self.MODE_SELECT
+        # drawn indicator state and its (line, pos), None - unknown
+        self._indicator = None
+        self._mark = None
 
     def on_left(self):
         if self.mode == self.MODE_SELECT:
-            self.current_index -= 1
-            if self.current_index < 0:
-                self.current_index = self.max_index
-            if not self.controller.selectable:
-                self.on_left()
-            self.update_indicator()
+            self.move_selection(-1)
         else:
             self.controller.on_left()
 
     def on_right(self):
         if self.mode == self.MODE_SELECT:
-            self.current_index += 1
-            if self.current_index > self.max_index:
-                self.current_index = 0
-            if not self.controller.selectable:
-                self.on_right()
-            self.update_indicator()
+            self.move_selection(1)
         else:
             self.controller.on_right()
 
+    def move_selection(self, step):
+        """Select next selectable item in step direction"""
+        index = self.current_index
+        while True:
+            index += step
+            if index < 0:
+                index = self.max_index
+            elif index > self.max_index:
+                index = 0
+            if self.items[index].selectable:
+                break
+        self.current_index = index
+        self.update_indicator()
+
     @property
     def controller(self):
         return self.items[self.current_index]    # type: Controller
@@ -496,82 +937,117 @@ class Menu(RObject):
     def change_focus(self):
         if self.mode == self.MODE_SELECT:
             self.mode = self.MODE_EDIT
-            self.clear_left()
             self.controller.on_enter()
         else:
             self.mode = self.MODE_SELECT
-            self.clear_right()
             self.controller.on_exit()
         self.update_indicator()
 
     def render_menu(self):
         for i in self.items:
             i.render()
+        # screen state is unknown, redraw indicator from scratch
+        self._indicator = None
+        self._mark = None
         self.update_indicator()
 
     def update_indicator(self):
+        state = (self.mode << 2) | self.current_index
+        if state == self._indicator:
+            return
+        self._indicator = state
+        self.clear_indicator()
         if self.mode == self.MODE_SELECT:
-            self.clear_left()
-            LCD.print_line(self.current_index, '>')
+            pos, char = 0, '>'
         else:
-            self.clear_right()
-            LCD.print_line(self.current_index, '<', start_pos=19)
-
-    def clear_left(self):
-        for i in range(4):
-            LCD.print_line(i, ' ')
-
-    def clear_right(self):
-        for i in range(4):
-            LCD.print_line(i, ' ', start_pos=Display.LINES-1)
-
-    def receive(self, event, *args):
-        if event == 'rerender':
-            self.render_menu()
+            pos, char = Display.LINES-1, '<'
+        LCD.print_line(self.current_index, char, start_pos=pos)
+        self._mark = (self.current_index, pos)
+
+    def clear_indicator(self):
+        if self._mark is None:
+            # not known where it was drawn, clear both columns
+            LCD.clear_column(0)
+            LCD.clear_column(Display.LINES-1)
+        else:
+            LCD.print_line(self._mark[0], ' ', start_pos=self._mark[1])
 
 
 class ControllerTitle(Controller):
     """First line controller"""
     selectable = False
-    title_list = {
-        Program.STATE_STOPPED: 'OFFLINE'.center(18).replace(' ', '='),
-        Program.STATE_ONLINE:  '==ON===',
-        Program.STATE_OFFLINE: '==OFF==',
-    }
+    value_width = 8
+    # indexed by Program.STATE_*, padded to max_width, bytes go to the screen buffer as is
+    TITLES = (
+        b'=====OFFLINE======',  # STATE_STOPPED
+        b'==OFF==           ',  # STATE_OFFLINE
+        b'==ON===           ',  # STATE_ONLINE
+    )
 
     def __init__(self):
         super(ControllerTitle, self).__init__()
         self.eta = 0
         self.mode = Program.STATE_STOPPED
+        self._padded_title = self.TITLES[self.mode]
+        # last formatted eta and its text, 'hh:mm:' prefix for eta // 60
+        self._eta = -1
+        self._eta_text = ''
+        self._eta_min = -1
+        self._eta_prefix = ''
 
     def get_title(self):
-        return self.title_list[self.mode]
+        return self.TITLES[self.mode]
 
     def get_value(self):
         if self.mode == Program.STATE_STOPPED:
             return ''
-        m, s = divmod(self.eta, 60)
-        h, m = divmod(m, 60)
-        return '{:02d}:{:02d}:{:02d}'.format(h, m, s)
+        eta = self.eta
+        if eta == self._eta:
+            return self._eta_text
+        d = _DIGIT_PAIRS
+        m, s = divmod(eta, 60)
+        if m != self._eta_min:
+            # minutes change once per 60 ticks
+            self._eta_min = m
+            h, m = divmod(m, 60)
+            self._eta_prefix = d[h] + ':' + d[m] + ':'
+        self._eta = eta
+        self._eta_text = self._eta_prefix + d[s]
+        return self._eta_text
+
+    def _on_update_eta(self, eta):
+        if eta == self.eta:
+            return
+        self.eta = eta
+        self.render_value()
+
+    def _on_set_state(self, state):
+        self.mode = state
+        self._padded_title = self.TITLES[state]
+        self.render()
 
-    def receive(self, event, *args):
-        if event == 'update_eta':
-            self.eta = args[0]
-            self.render()
-        elif event == 'set_state':
-            self.mode = args[0]
-            self.render()
+    _HANDLERS = {
+        EV_UPDATE_ETA: '_on_update_eta',
+        EV_SET_STATE: '_on_set_state',
+    }
 
 
 class ControllerTime(Controller):
     """Base time controller"""
     title = 'TIME'
+    # options key and event code of the value
     event_name = ''
+    event = 0
+    value_width = 5
 
     def __init__(self, init_time=None):
         super(ControllerTime, self).__init__()
         self.time = self.restore_value(init_time)
-        self.on_exit()
+        # 'hh:mm' of self.time, updated in place by get_value()
+        self._value = bytearray(b'00:00')
+        # value changed by encoder since last on_exit
+        self._dirty = False
+        self.emit_value()
 
     def restore_value(self, init_time=None):
         if self.event_name:
@@ -581,70 +1057,91 @@ class ControllerTime(Controller):
         return t or 0
 
     def get_value(self):
-        h = self.time // 60
-        m = self.time - (h * 60)
-        return '{}:{}'.format("{:02d}".format(h), "{:02d}".format(m))
+        h, m = divmod(self.time, 60)
+        buf = self._value
+        buf[0] = 0x30 + h // 10
+        buf[1] = 0x30 + h % 10
+        buf[3] = 0x30 + m // 10
+        buf[4] = 0x30 + m % 10
+        return buf
 
     def on_left(self):
         self.time += 1
         if self.time >= 6000:
             self.time = 0
-        super(ControllerTime, self).on_right()
+        self._dirty = True
+        self.render_value()
 
     def on_right(self):
         self.time = max(0, self.time-1)
-        super(ControllerTime, self).on_left()
+        self._dirty = True
+        self.render_value()
 
-    def receive(self, event, *args):
-        if event == 'reset':
-            self.time = 0
-            self.emit(self.event_name, self.time)
-            self.render()
+    def _on_reset(self):
+        self.time = 0
+        self.emit1(self.event, self.time)
+        self.render()
+
+    def emit_value(self):
+        if self.event:
+            self.emit1(self.event, self.time*60)
 
     def on_exit(self):
+        if not self._dirty:
+            return
+        self._dirty = False
         if self.event_name:
             Store.set(self.event_name, self.time)
-            self.emit(self.event_name, self.time*60)
+            Store.flush()
+        self.emit_value()
+
+    _HANDLERS = {
+        EV_RESET: '_on_reset',
+    }
 
 
 class ControllerOnline(ControllerTime):
     """Online time controller"""
     title = 'ON'
     event_name = 'online_changed'
+    event = EV_ONLINE_CHANGED
 
 
 class ControllerOffline(ControllerTime):
     """Offline time controller"""
     title = 'OFF'
     event_name = 'offline_changed'
+    event = EV_OFFLINE_CHANGED
 
 
 class ControllerActions(Controller):
     """Commands controller"""
     title = 'ACTION'
+    value_width = 9
     MODE_ACTIVE = 1
     MODE_INACTIVE = 0
-    null_action = '<= '
-    actions_base = ['RESET', 'REBOOT', null_action]
-    actions = {
-        0: ['START ON', 'START OFF']+actions_base,
-        1: ['STOP', 'NEXT']+actions_base,
-    }
+    # indexed by mode, literals only so a frozen module keeps the strings in flash
+    actions = (
+        ('START ON', 'START OFF', 'RESET', 'REBOOT', '<= '),    # MODE_INACTIVE
+        ('STOP', 'NEXT', 'RESET', 'REBOOT', '<= '),             # MODE_ACTIVE
+    )
+    # event codes of actions, 0 - no action
+    action_events = (
+        (EV_START_ON, EV_START_OFF, EV_RESET, EV_REBOOT, 0),
+        (EV_STOP, EV_NEXT, EV_RESET, EV_REBOOT, 0),
+    )
+    # last action index, same in both modes
+    max_index = 4
 
     def __init__(self):
         super(ControllerActions, self).__init__()
         self.current_index = 0
-        self.max_index = 0
         self.mode = self.MODE_INACTIVE
 
     def set_mode(self, value):
         self.mode = value
-        self.max_index = len(self.actions[value]) - 1
         self.render()
 
-    def get_title(self):
-        return super(ControllerActions, self).get_title()
-
     def get_value(self):
         return self.current_action()
 
@@ -652,35 +1149,46 @@ class ControllerActions(Controller):
         self.current_index -= 1
         if self.current_index < 0:
             self.current_index = self.max_index
-        super(ControllerActions, self).on_left()
+        self.render_value()
 
     def on_right(self):
         self.current_index += 1
         if self.current_index > self.max_index:
             self.current_index = 0
-        super(ControllerActions, self).on_right()
+        self.render_value()
 
     def current_action(self):
         return self.actions[self.mode][self.current_index]
 
     def on_exit(self):
-        action = self.current_action()
-        if action != self.null_action:
-            event = action.lower().replace(' ', '_')
-            self.emit(event)
+        event = self.action_events[self.mode][self.current_index]
+        if event:
+            self.emit0(event)
         self.current_index = 0
-        super(ControllerActions, self).on_exit()
+        self.render_value()
 
-    def receive(self, event, *args):
-        if event == 'set_state':
-            if args[0] == Program.STATE_STOPPED:
-                self.set_mode(self.MODE_INACTIVE)
-            else:
-                self.set_mode(self.MODE_ACTIVE)
-            self.render()
+    def _on_set_state(self, state):
+        if state == Program.STATE_STOPPED:
+            self.set_mode(self.MODE_INACTIVE)
+        else:
+            self.set_mode(self.MODE_ACTIVE)
+
+    _HANDLERS = {
+        EV_SET_STATE: '_on_set_state',
+    }
+
+
+def setup():
+    """Create the LCD, call before any use of it, main() calls it too"""
+    global LCD
+    if LCD is None:
+        # one bus for the LCD and any other I2C device
+        i2c, freq = Display.init_i2c()
+        LCD = Display(i2c, freq)
 
 
 def main():
+    setup()
     core = Program()
     items = [
         ControllerTitle(), ControllerOnline(), ControllerOffline(), ControllerActions()
@@ -693,16 +1201,39 @@ def main():
         on_press=menu.on_press
     )
     menu.render_menu()
-
-    # Main loop
+    # startup garbage is gone, collect early after a quarter of the free heap is allocated
+    gc.collect()
+    gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
+    try:
+        asyncio.run(main_loop(events, idle, core))
+    except KeyboardInterrupt:
+        events.emit0(EV_STOP)
+        RObject.process_events()
+        LCD.flush()
+
+
+async def main_loop(events, idle, core):
+    loops = 0
     while True:
-        try:
-            # check device events
-            events.update()
-            # delivery events
-            RObject.process_events()
-            time.sleep(0.05)
-        except KeyboardInterrupt:
-            events.emit('stop')
-            events.update()
-            break
+        # check device events and timeouts
+        events.update()
+        idle.update()
+        LCD.update()
+        # delivery events
+        RObject.process_events()
+        LCD.flush()
+        loops = (loops + 1) & GC_LOOPS_MASK
+        if not loops:
+            gc.collect()
+        if idle.is_idle:
+            # backlight is off, light sleep until input or the program switch
+            ms = core.time_to_switch()
+            if ms < 0 or ms > IDLE_SLEEP_MS:
+                ms = IDLE_SLEEP_MS
+            if ms:
+                events.sleep(ms)
+            # run the program task if it is due
+            await asyncio.sleep_ms(0)
+        else:
+            # sleep until next interrupt or timer
+            await WAKE.wait()